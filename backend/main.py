@@ -12,13 +12,36 @@ Author: Dang Khoa
 Created: Oct 2025
 """
 
+import importlib.util
+import os
+from contextlib import asynccontextmanager
+import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from routers import chat_router, image_router, csv_router
+from utils.logging_setup import start_log_listener
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the background log listener for the lifetime of the app."""
+    listener = start_log_listener()
+    try:
+        yield
+    finally:
+        listener.stop()
+
 
 # Initialize FastAPI application
-app = FastAPI(title="AI Chat Backend", version="1.0.0")
+app = FastAPI(
+    title="AI Chat Backend",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 app.mount("/temp_uploads", StaticFiles(directory="data/temp_uploads"), name="temp_uploads")
 
@@ -31,6 +54,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses (long replies, CSV summaries). Starlette skips
+# text/event-stream by default, so SSE frames are still flushed per chunk.
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
 # Register routers
 app.include_router(chat_router.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(image_router.router, prefix="/api/image", tags=["Image"])
@@ -41,3 +68,16 @@ app.include_router(csv_router.router, prefix="/api/csv", tags=["CSV"])
 def root():
     """Health check endpoint."""
     return {"message": "✅ AI Chat Backend is running successfully!"}
+
+
+if __name__ == "__main__":
+    # uvloop + httptools give the event loop and HTTP parser a C fast path;
+    # fall back to the asyncio loop where uvloop is unavailable (e.g. Windows).
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("FASTAPI_HOST", "0.0.0.0"),
+        port=int(os.getenv("FASTAPI_PORT", "8000")),
+        workers=int(os.getenv("FASTAPI_WORKERS", "1")),
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools",
+    )
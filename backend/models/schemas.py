@@ -2,11 +2,15 @@
 schemas.py
 -----------
 Defines Pydantic models for request and response validation.
+
+Pydantic models document the API (OpenAPI schema); the msgspec.Struct
+variants (suffix "MS") are used on the hot path to decode chat history.
 """
 
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional, List
+import msgspec
 
 
 class ChatMessage(BaseModel):
@@ -80,3 +84,33 @@ class CSVChatResponse(BaseModel):
     """Response model for CSV-based chat."""
     reply: str
     history: List[CSVChatMessage]
+
+
+# ------------------------------------------------------------
+# msgspec structs — fast history decoding (same fields as above)
+# ------------------------------------------------------------
+class ChatMessageMS(msgspec.Struct):
+    """msgspec variant of ChatMessage for decoding history."""
+    role: str
+    content: str
+    timestamp: Optional[datetime] = None
+    image_url: Optional[str] = None
+    file_url: Optional[str] = None
+
+
+class ImageChatMessageMS(msgspec.Struct):
+    """msgspec variant of ImageChatMessage for decoding history."""
+    role: str
+    content: str
+    image_url: Optional[str] = None
+    file_url: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
+
+class CSVChatMessageMS(msgspec.Struct):
+    """msgspec variant of CSVChatMessage for decoding history."""
+    role: str
+    content: str
+    image_url: Optional[str] = None
+    file_url: Optional[str] = None
+    timestamp: Optional[datetime] = None
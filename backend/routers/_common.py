@@ -0,0 +1,50 @@
+"""
+_common.py
+-----------
+Helpers shared by the chat, CSV and image routers.
+"""
+
+from fastapi import HTTPException
+import msgspec
+
+# Frontend roles that differ from Gemini's ("assistant" -> "model")
+_GEMINI_ROLES = {"assistant": "model"}
+
+
+def parse_history(raw: str, model_cls: type) -> list:
+    """
+    Decode the JSON history form field into typed messages.
+
+    Args:
+        raw (str): JSON string of previous chat messages.
+        model_cls (type): msgspec.Struct message type (e.g. ChatMessageMS).
+
+    Returns:
+        list: Decoded messages.
+
+    Raises:
+        HTTPException: 422 if the history is not valid JSON for model_cls.
+    """
+    try:
+        return msgspec.json.decode(raw or "[]", type=list[model_cls])
+    except msgspec.DecodeError:
+        raise HTTPException(status_code=422, detail="Invalid JSON in history")
+
+
+def to_gemini_messages(history: list, user_msg: str) -> list[dict]:
+    """
+    Build the Gemini message list from history plus the new user turn.
+
+    Args:
+        history (list): Previous messages (objects with role and content).
+        user_msg (str): Current user message.
+
+    Returns:
+        list[dict]: Messages with Gemini role names, oldest first.
+    """
+    messages = [
+        {"role": _GEMINI_ROLES.get(m.role, m.role), "content": m.content}
+        for m in history
+    ]
+    messages.append({"role": "user", "content": user_msg})
+    return messages
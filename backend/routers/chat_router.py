@@ -4,16 +4,17 @@ chat_router.py
 Handles text-only chat with Gemini (multi-turn conversation).
 """
 
-from fastapi import APIRouter, Form, HTTPException
-from fastapi.responses import StreamingResponse
-from models.schemas import ChatResponse, ChatMessage
-from services.gemini_service import ask_gemini_text, ask_gemini_text_streaming
-from datetime import datetime
-import json
+from fastapi import APIRouter, Form
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from models.schemas import ChatResponse, ChatMessageMS
+from routers._common import parse_history, to_gemini_messages
+from services.gemini_service import ask_gemini_text_async, ask_gemini_text_streaming
+from utils.serialization import sse_event, sse_chunk, coalesce_chunks
+from datetime import datetime, timezone
 
 router = APIRouter()
 
-@router.post("/", response_model=ChatResponse)
+@router.post("/", responses={200: {"model": ChatResponse}})
 async def chat(
     message: str = Form(...),
     stream: bool = Form(False),
@@ -28,104 +29,69 @@ async def chat(
         history (str): JSON string of previous chat messages.
 
     Returns:
-        StreamingResponse or ChatResponse: Streams JSON chunks or returns full response.
+        StreamingResponse or ORJSONResponse: Streams JSON chunks or returns full response.
     """
     async def stream_response():
         try:
             # Parse history safely
-            try:
-                history_list = json.loads(history) if history else []
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=422, detail="Invalid JSON in history")
-            
-            history_messages = [ChatMessage(**msg) for msg in history_list]
-            
+            history_messages = parse_history(history, ChatMessageMS)
 
             # Prepare messages for Gemini
-            messages = [{"role": "model" if m.role == "assistant" else m.role, "content": m.content} for m in history_messages] + [
-                {"role": "user", "content": message}
-            ]
+            messages = to_gemini_messages(history_messages, message)
             response = None
             full_response = ""
 
             # Process text query
             if stream:
-                async for chunk in ask_gemini_text_streaming(messages):
-                    full_response += chunk + " "
-                    yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+                async for chunk in coalesce_chunks(ask_gemini_text_streaming(messages)):
+                    full_response += chunk
+                    yield sse_chunk(chunk)
             else:
-                response = ask_gemini_text(messages)
-                yield f"data: {json.dumps({'reply': response}, ensure_ascii=False)}\n\n"
+                response = await ask_gemini_text_async(messages)
+                yield sse_event({'reply': response})
 
             # Update history
-            current_time = datetime.now().replace(microsecond=0)
-            updated_history = history_messages + [
-                ChatMessage(
-                    role="user",
-                    content=message,
-                    image_url=None,
-                    file_url=None,
-                    timestamp=current_time
-                ),
-                ChatMessage(
-                    role="assistant",
-                    content=response if response else full_response.strip(),
-                    image_url=None,
-                    file_url=None,
-                    timestamp=current_time
-                )
-            ]
-            # Convert datetime to ISO string for JSON serialization
+            ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
             history_dict = [
                 {
                     "role": msg.role,
                     "content": msg.content,
-                    "timestamp": msg.timestamp.isoformat()
+                    "timestamp": msg.timestamp
                 }
-                for msg in updated_history
+                for msg in history_messages
+            ] + [
+                {"role": "user", "content": message, "timestamp": ts_iso},
+                {"role": "assistant", "content": response if response else full_response.strip(), "timestamp": ts_iso}
             ]
-            yield f"data: {json.dumps({'history': history_dict, 'status': 'complete'}, ensure_ascii=False)}\n\n"
+            yield sse_event({'history': history_dict, 'status': 'complete'})
 
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield sse_event({'error': str(e)})
 
     if stream:
         return StreamingResponse(stream_response(), media_type="text/event-stream")
     else:
         # Non-streaming response
-        try:
-            history_list = json.loads(history) if history else []
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=422, detail="Invalid JSON in history")
-        history_messages = [ChatMessage(**msg) for msg in history_list]
+        history_messages = parse_history(history, ChatMessageMS)
 
         # Prepare messages for Gemini
-        messages = [{"role": "model" if m.role == "assistant" else m.role, "content": m.content} for m in history_messages] + [
-            {"role": "user", "content": message}
-        ]
-        response = ask_gemini_text(messages)
+        messages = to_gemini_messages(history_messages, message)
+        response = await ask_gemini_text_async(messages)
 
         # Update history
-        current_time = datetime.now().replace(microsecond=0)
-        updated_history = history_messages + [
-            ChatMessage(
-                role="user",
-                content=message,
-                timestamp=current_time
-            ),
-            ChatMessage(
-                role="assistant",
-                content=response,
-                timestamp=current_time
-            )
-        ]
-        # Convert datetime to ISO string for JSON serialization
+        ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
         history_dict = [
             {
                 "role": msg.role,
                 "content": msg.content,
-                "timestamp": msg.timestamp.isoformat()
+                "image_url": msg.image_url,
+                "file_url": msg.file_url,
+                "timestamp": msg.timestamp
             }
-            for msg in updated_history
+            for msg in history_messages
+        ] + [
+            {"role": "user", "content": message, "image_url": None, "file_url": None, "timestamp": ts_iso},
+            {"role": "assistant", "content": response, "image_url": None, "file_url": None, "timestamp": ts_iso}
         ]
-        return ChatResponse(reply=response, history=updated_history)
\ No newline at end of file
+        payload = {"reply": response, "history": history_dict}
+        return ORJSONResponse(payload)
\ No newline at end of file
@@ -6,23 +6,32 @@ STRUCTURE SIMILAR TO chat_router.py
 """
 
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse
-from models.schemas import CSVChatResponse, CSVChatMessage
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from models.schemas import CSVChatResponse, CSVChatMessageMS
+from routers._common import parse_history
 from services.csv_service import (
     summarize_csv, 
     save_uploaded_csv, 
-    ask_gemini_about_data, 
+    ask_gemini_about_data_async, 
     ask_gemini_about_data_streaming,
     download_csv_from_url, 
     generate_histogram_data
 )
-from datetime import datetime
-import json
+from utils.serialization import to_json, sse_event, sse_chunk, coalesce_chunks
+from datetime import datetime, timezone
+from pathlib import Path
 import re
+import orjson
 
 router = APIRouter()
 
-@router.post("/", response_model=CSVChatResponse)
+# Histogram request detector, compiled once at import (case-insensitive, Unicode-aware)
+_HIST_RE = re.compile(
+    r"(?:histogram|vẽ biểu đồ|biểu đồ phân phối|phân phối|vẽ histogram|plot|chart|graph)\s*(?:cột |cho |của |về |for |of |)\s*(?:cột |column |)\s*['\"]?([\w\s]+?)['\"]?(\s*(?:dùm tôi|nha|please|\s*$|\b))",
+    re.IGNORECASE
+)
+
+@router.post("/", responses={200: {"model": CSVChatResponse}})
 async def chat_with_csv(
     question: str = Form(...),
     file: UploadFile = File(None),
@@ -42,173 +51,136 @@ async def chat_with_csv(
         history (str): JSON string of previous chat messages.
 
     Returns:
-        StreamingResponse or CSVChatResponse: Streams JSON chunks or returns full response.
+        StreamingResponse or ORJSONResponse: Streams JSON chunks or returns full response.
     """
     async def stream_response():
         try:
             # Parse history safely
-            try:
-                history_list = json.loads(history) if history else []
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=422, detail="Invalid JSON in history")
-            history_messages = [CSVChatMessage(**msg) for msg in history_list]
+            history_messages = parse_history(history, CSVChatMessageMS)
 
             file_url = None
-            content_text = None
+            csv_content = None
             response = None
             file_name = None
             full_response = ""
 
             # Load CSV content from uploaded file or URL
             if file:
-                content_bytes = await file.read()
-                content_text = content_bytes.decode("utf-8-sig")
                 file_name = file.filename or "uploaded_file.csv"
-                if not content_text.strip():
-                    yield f"data: {json.dumps({'error': 'The CSV file is empty or contains no data.'}, ensure_ascii=False)}\n\n"
-                    return
-                file_url = save_uploaded_csv(file, content_bytes)
+                file_url = save_uploaded_csv(file)
+                csv_content = Path(file_url)
             elif url:
-                content_text = download_csv_from_url(url)
+                csv_content = await download_csv_from_url(url)
                 file_name = url.split('/')[-1] or "remote_file.csv"
                 file_url = url
             else:
-                yield f"data: {json.dumps({'error': 'Must provide either file or URL.'}, ensure_ascii=False)}\n\n"
+                yield sse_event({'error': 'Must provide either file or URL.'})
                 return
 
             # Detect histogram requests
-            histogram_match = re.search(
-                r"(?:histogram|vẽ biểu đồ|biểu đồ phân phối|phân phối|vẽ histogram|plot|chart|graph)\s*(?:cột |cho |của |về |for |of |)\s*(?:cột |column |)\s*['\"]?([\w\s]+?)['\"]?(\s*(?:dùm tôi|nha|please|\s*$|\b))",
-                question.lower()
-            )
+            histogram_match = _HIST_RE.search(question)
 
             if histogram_match:
                 # Handle histogram (non-streaming, instant response)
                 column = histogram_match.group(1).strip()
-                hist_data = generate_histogram_data(content_text, column)
+                hist_data = generate_histogram_data(csv_content, column)
                 if "error" in hist_data:
                     response = hist_data["error"]
                 else:
-                    response = f"📊 Histogram data for '{column}':\n{json.dumps(hist_data, indent=2)}"
-                yield f"data: {json.dumps({'reply': response}, ensure_ascii=False)}\n\n"
+                    response = f"📊 Histogram data for '{column}':\n{to_json(hist_data, option=orjson.OPT_INDENT_2)}"
+                yield sse_event({'reply': response})
                 full_response = response
             else:
                 # Handle AI analysis
-                summary = summarize_csv(content_text)
+                summary = summarize_csv(csv_content)
                 if summary.startswith("❌"):
-                    yield f"data: {json.dumps({'error': summary}, ensure_ascii=False)}\n\n"
+                    yield sse_event({'error': summary})
                     return
 
                 # Process with streaming or non-streaming
                 if stream:
-                    async for chunk in ask_gemini_about_data_streaming(question, summary, file_name):
+                    async for chunk in coalesce_chunks(ask_gemini_about_data_streaming(question, summary, file_name)):
                         full_response += chunk
-                        yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+                        yield sse_chunk(chunk)
                 else:
-                    response = ask_gemini_about_data(question, summary, file_name)
-                    yield f"data: {json.dumps({'reply': response}, ensure_ascii=False)}\n\n"
+                    response = await ask_gemini_about_data_async(question, summary, file_name)
+                    yield sse_event({'reply': response})
                     full_response = response
 
             # Update history
-            current_time = datetime.now().replace(microsecond=0)
-            updated_history = history_messages + [
-                CSVChatMessage(
-                    role="user",
-                    content=question,
-                    image_url=None,
-                    file_url=file_url,
-                    timestamp=current_time
-                ),
-                CSVChatMessage(
-                    role="assistant",
-                    content=full_response if not response else response,
-                    image_url=None,
-                    file_url=None,
-                    timestamp=current_time
-                )
-            ]
-            
-            # Convert datetime to ISO string for JSON serialization
+            ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
             history_dict = [
                 {
                     "role": msg.role,
                     "content": msg.content,
                     "file_url": msg.file_url,
-                    "timestamp": msg.timestamp.isoformat()
+                    "timestamp": msg.timestamp
                 }
-                for msg in updated_history
+                for msg in history_messages
+            ] + [
+                {"role": "user", "content": question, "file_url": file_url, "timestamp": ts_iso},
+                {"role": "assistant", "content": full_response if not response else response, "file_url": None, "timestamp": ts_iso}
             ]
             
-            yield f"data: {json.dumps({'history': history_dict, 'status': 'complete'}, ensure_ascii=False)}\n\n"
+            yield sse_event({'history': history_dict, 'status': 'complete'})
 
+        except HTTPException as e:
+            yield sse_event({'error': e.detail})
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield sse_event({'error': str(e)})
 
     if stream:
         return StreamingResponse(stream_response(), media_type="text/event-stream")
     else:
         # Non-streaming response (identical to chat_router structure)
-        try:
-            history_list = json.loads(history) if history else []
-        except json.JSONDecodeError:
-            raise HTTPException(status_code=422, detail="Invalid JSON in history")
-        history_messages = [CSVChatMessage(**msg) for msg in history_list]
+        history_messages = parse_history(history, CSVChatMessageMS)
 
         file_url = None
-        content_text = None
+        csv_content = None
         file_name = None
 
         # Load CSV content
         if file:
-            content_bytes = await file.read()
-            content_text = content_bytes.decode("utf-8-sig")
             file_name = file.filename or "uploaded_file.csv"
-            if not content_text.strip():
-                raise HTTPException(status_code=400, detail="The CSV file is empty or contains no data.")
-            file_url = save_uploaded_csv(file, content_bytes)
+            file_url = save_uploaded_csv(file)
+            csv_content = Path(file_url)
         elif url:
-            content_text = download_csv_from_url(url)
+            csv_content = await download_csv_from_url(url)
             file_name = url.split('/')[-1] or "remote_file.csv"
             file_url = url
         else:
             raise HTTPException(status_code=400, detail="Must provide either file or URL.")
 
         # Detect histogram
-        histogram_match = re.search(
-            r"(?:histogram|vẽ biểu đồ|biểu đồ phân phối|phân phối|vẽ histogram|plot|chart|graph)\s*(?:cột |cho |của |về |for |of |)\s*(?:cột |column |)\s*['\"]?([\w\s]+?)['\"]?(\s*(?:dùm tôi|nha|please|\s*$|\b))",
-            question.lower()
-        )
+        histogram_match = _HIST_RE.search(question)
 
         if histogram_match:
             column = histogram_match.group(1).strip()
-            hist_data = generate_histogram_data(content_text, column)
+            hist_data = generate_histogram_data(csv_content, column)
             if "error" in hist_data:
                 response = hist_data["error"]
             else:
-                response = f"📊 Histogram data for '{column}':\n{json.dumps(hist_data, indent=2)}"
+                response = f"📊 Histogram data for '{column}':\n{to_json(hist_data, option=orjson.OPT_INDENT_2)}"
         else:
-            summary = summarize_csv(content_text)
+            summary = summarize_csv(csv_content)
             if summary.startswith("❌"):
                 raise HTTPException(status_code=400, detail=summary)
-            response = ask_gemini_about_data(question, summary, file_name)
+            response = await ask_gemini_about_data_async(question, summary, file_name)
 
         # Update history
-        current_time = datetime.now().replace(microsecond=0)
-        updated_history = history_messages + [
-            CSVChatMessage(
-                role="user",
-                content=question,
-                file_url=file_url,
-                file_name=file_name,
-                timestamp=current_time
-            ),
-            CSVChatMessage(
-                role="assistant",
-                content=response,
-                file_url=None,
-                file_name=file_name,
-                timestamp=current_time
-            )
+        ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+        history_dict = [
+            {
+                "role": msg.role,
+                "content": msg.content,
+                "image_url": msg.image_url,
+                "file_url": msg.file_url,
+                "timestamp": msg.timestamp
+            }
+            for msg in history_messages
+        ] + [
+            {"role": "user", "content": question, "image_url": None, "file_url": file_url, "timestamp": ts_iso},
+            {"role": "assistant", "content": response, "image_url": None, "file_url": None, "timestamp": ts_iso}
         ]
-
-        return CSVChatResponse(reply=response, history=updated_history)
\ No newline at end of file
+        payload = {"reply": response, "history": history_dict}
+        return ORJSONResponse(payload)
\ No newline at end of file
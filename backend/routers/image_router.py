@@ -5,17 +5,18 @@ Routes for image upload and visual question answering.
 """
 
 import os
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from services.image_service import save_uploaded_image, ask_gemini_with_image, ask_gemini_with_image_streaming
-from models.schemas import ImageChatRequest, ImageChatResponse, ImageChatMessage
-from datetime import datetime
-from fastapi.responses import StreamingResponse
-import json
+from fastapi import APIRouter, UploadFile, File, Form
+from services.image_service import save_uploaded_image, ask_gemini_with_image_async, ask_gemini_with_image_streaming
+from models.schemas import ImageChatResponse, ImageChatMessageMS
+from routers._common import parse_history
+from utils.serialization import sse_event, sse_chunk, coalesce_chunks
+from datetime import datetime, timezone
+from fastapi.responses import StreamingResponse, ORJSONResponse
 
 router = APIRouter()
 
 
-@router.post("/", response_model=ImageChatResponse)
+@router.post("/", responses={200: {"model": ImageChatResponse}})
 async def chat_with_image(
     question: str = Form(...),
     file: UploadFile = File(...),
@@ -32,13 +33,13 @@ async def chat_with_image(
         history (str): JSON string of previous chat messages.
 
     Returns:
-        StreamingResponse or dict: Streams JSON chunks or returns full response.
+        StreamingResponse or ORJSONResponse: Streams JSON chunks or returns full response.
     """
     async def stream_response():
         try:
             # Parse history
-            history_list = json.loads(history) if history else []
-            history_messages = [ImageChatMessage(**msg) for msg in history_list]
+            history_messages = parse_history(history, ImageChatMessageMS)
+
             image_path = save_uploaded_image(file)
             filename = os.path.basename(image_path)
             image_url = f"http://127.0.0.1:8000/temp_uploads/{filename}"
@@ -48,71 +49,58 @@ async def chat_with_image(
 
             # Process image query
             if stream:
-                async for chunk in ask_gemini_with_image_streaming(question, image_path):
+                async for chunk in coalesce_chunks(ask_gemini_with_image_streaming(question, image_path)):
                     full_response += chunk
-                    yield f"data: {json.dumps({'chunk': chunk}, ensure_ascii=False)}\n\n"
+                    yield sse_chunk(chunk)
             else:
-                response = ask_gemini_with_image(question, image_path)
-                yield f"data: {json.dumps({'reply': response}, ensure_ascii=False)}\n\n"
+                response = await ask_gemini_with_image_async(question, image_path)
+                yield sse_event({'reply': response})
 
             # Update history
-            current_time = datetime.now().replace(microsecond=0)
-            updated_history = history_messages + [
-                ImageChatMessage(
-                    role="user",
-                    content=question,
-                    image_url=image_url,
-                    file_url=None,
-                    timestamp=current_time
-                ),
-                ImageChatMessage(
-                    role="assistant",
-                    content=response if response else full_response.strip(),
-                    image_url=None,
-                    file_url=None,
-                    timestamp=current_time
-                )
-            ]
-
-            # Convert datetime to ISO string for JSON serialization
+            ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
             history_dict = [
                 {
                     "role": msg.role,
                     "content": msg.content,
                     "image_url": msg.image_url,
-                    "timestamp": msg.timestamp.isoformat()
+                    "timestamp": msg.timestamp
                 }
-                for msg in updated_history
+                for msg in history_messages
+            ] + [
+                {"role": "user", "content": question, "image_url": image_url, "timestamp": ts_iso},
+                {"role": "assistant", "content": response if response else full_response.strip(), "image_url": None, "timestamp": ts_iso}
             ]
 
-            yield f"data: {json.dumps({'history': history_dict, 'status': 'complete'}, ensure_ascii=False)}\n\n"
+            yield sse_event({'history': history_dict, 'status': 'complete'})
             
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+            yield sse_event({'error': str(e)})
 
     if stream:
         return StreamingResponse(stream_response(), media_type="text/event-stream")
     else:
         # Non-streaming response
-        history_list = json.loads(history) if history else []
-        history_messages = history_list
+        history_messages = parse_history(history, ImageChatMessageMS)
+
         image_path = save_uploaded_image(file)
         filename = os.path.basename(image_path)
         image_url = f"http://127.0.0.1:8000/temp_uploads/{filename}"
-        response = ask_gemini_with_image(question, image_path)
-        current_time = datetime.now().replace(microsecond=0)
-        updated_history = history_messages + [
-            {
-                "role": "user",
-                "content": question,
-                "image_url": image_url,
-                "timestamp": current_time.isoformat()
-            },
+        response = await ask_gemini_with_image_async(question, image_path)
+
+        # Update history
+        ts_iso = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+        history_dict = [
             {
-                "role": "assistant",
-                "content": response,
-                "image_url": None,
-                "timestamp": current_time.isoformat()
+                "role": msg.role,
+                "content": msg.content,
+                "image_url": msg.image_url,
+                "file_url": msg.file_url,
+                "timestamp": msg.timestamp
             }
+            for msg in history_messages
+        ] + [
+            {"role": "user", "content": question, "image_url": image_url, "file_url": None, "timestamp": ts_iso},
+            {"role": "assistant", "content": response, "image_url": None, "file_url": None, "timestamp": ts_iso}
         ]
-        return {"reply": response, "history": updated_history}
\ No newline at end of file
+        payload = {"reply": response, "history": history_dict}
+        return ORJSONResponse(payload)
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+batch_queue.py
+---------------
+Micro-batching helper: coalesces independent requests that arrive within a
+short window into a single call of a batch handler.
+"""
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class BatchQueue:
+    """
+    Collects submitted items and hands them to ``handler`` in groups of at
+    most ``max_batch``, waiting up to ``window`` seconds after the first item
+    for more to arrive.
+
+    ``handler`` receives the list of items and must return one result per
+    item, in the same order. Each batch is dispatched as its own task, so a
+    slow batch never holds back the next one.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list], Awaitable[list]],
+        max_batch: int = 4,
+        window: float = 0.025,
+    ):
+        """
+        Args:
+            handler (Callable): Async callable mapping a list of items to a list of results.
+            max_batch (int): Maximum number of items per handler call.
+            window (float): Seconds to wait for more items after the first one.
+        """
+        self.handler = handler
+        self.max_batch = max_batch
+        self.window = window
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._loop = None
+        self._inflight: set[asyncio.Task] = set()  # keeps dispatched batches referenced
+
+    async def submit(self, item):
+        """
+        Queue ``item`` for the next batch and wait for its result.
+
+        Args:
+            item: Payload passed to the handler.
+
+        Returns:
+            The handler's result for this item.
+        """
+        loop = asyncio.get_running_loop()
+        # The worker is bound to the loop it was started on
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: list):
+        try:
+            results = await self.handler([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch handler returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -4,67 +4,219 @@ csv_service.py
 Handles CSV upload, summary generation, and Gemini-based data analysis.
 """
 
-from http.client import HTTPException
+import logging
 import pandas as pd
 import os
-from io import StringIO
-from services.gemini_service import get_model
-from fastapi import UploadFile
-import requests
+import uuid
+from datetime import datetime
+from pathlib import Path
+from io import StringIO, BytesIO
+from services.gemini_service import get_model, iterate_in_thread, stream_text
+from fastapi import UploadFile, HTTPException
+import httpx
+import anyio
 import numpy as np
+from numba import njit
+from cachetools import LRUCache
+import xxhash
+
+logger = logging.getLogger(__name__)
 
 # Supported file extensions and content types
 ALLOWED_EXTENSIONS = {".csv", ".xlsx"}
 ALLOWED_CONTENT_TYPES = {"text/csv", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
 
 MAX_CSV_SIZE = 50 * 1024 * 1024
+COPY_CHUNK_SIZE = 1 << 20  # 1 MB
+
+# Per-process caches keyed by the xxh3 hash of the CSV content, so follow-up
+# questions on the same file skip re-parsing and re-summarizing it
+_DF_CACHE: LRUCache = LRUCache(maxsize=8)
+_SUMMARY_CACHE: LRUCache = LRUCache(maxsize=32)
+_HISTOGRAM_CACHE: LRUCache = LRUCache(maxsize=64)
+
 
-def save_uploaded_csv(file: UploadFile, content_bytes: bytes) -> str:
+@njit(cache=True)
+def _hist10(x, edges):
     """
-    Save uploaded CSV to processed folder.
+    Count values of a float64 array into 10 equal-width bins in a single pass.
+
+    Bin assignment follows np.histogram: the index is computed arithmetically,
+    then corrected by one bin against ``edges`` so values on a bin edge land
+    in the same bin numpy would put them in.
+
+    Args:
+        x (np.ndarray): 1-D float64 array of finite values within the edges.
+        edges (np.ndarray): 11 bin edges from np.linspace(lo, hi, 11).
+
+    Returns:
+        np.ndarray: int64 counts per bin.
+    """
+    counts = np.zeros(10, np.int64)
+    lo = edges[0]
+    norm = 10.0 / (edges[10] - lo)
+    for v in x:
+        k = int((v - lo) * norm)
+        if k >= 10:
+            k = 9
+        elif k < 0:
+            k = 0
+        if v < edges[k]:
+            k -= 1
+        elif k != 9 and v >= edges[k + 1]:
+            k += 1
+        counts[k] += 1
+    return counts
+
+def save_uploaded_csv(file: UploadFile) -> str:
+    """
+    Stream uploaded CSV to processed folder without buffering it in memory.
+
+    Each upload gets its own file name, so concurrent uploads with the same
+    original name never overwrite each other before they are parsed.
 
     Args:
         file (UploadFile): Uploaded CSV file.
-        content_bytes (bytes): Pre-read content of the file.
 
     Returns:
         str: Path to saved CSV.
+
+    Raises:
+        HTTPException: If the file is empty or whitespace-only, or exceeds MAX_CSV_SIZE.
     """
-    if len(content_bytes) > MAX_CSV_SIZE:
-        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {MAX_CSV_SIZE / (1024 * 1024)} MB.")
     try:
         os.makedirs("data/processed", exist_ok=True)
-        file_path = f"data/processed/{file.filename}"
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        file_name = Path(file.filename or "uploaded_file.csv").name
+        file_path = f"data/processed/{timestamp}_{uuid.uuid4().hex[:8]}_{file_name}"
+        file.file.seek(0)
+        blank = True
+        too_large = False
         with open(file_path, "wb") as f:
-            f.write(content_bytes)
+            while chunk := file.file.read(COPY_CHUNK_SIZE):
+                blank = blank and not chunk.strip()
+                f.write(chunk)
+                # Stop as soon as the limit is crossed instead of copying the rest
+                if f.tell() > MAX_CSV_SIZE:
+                    too_large = True
+                    break
+        if too_large:
+            os.remove(file_path)
+            raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {MAX_CSV_SIZE / (1024 * 1024)} MB.")
+        if blank:
+            os.remove(file_path)
+            raise HTTPException(status_code=400, detail="The CSV file is empty or contains no data.")
         return file_path
+    except HTTPException:
+        raise
     except Exception as e:
         raise Exception(f"Failed to save CSV: {e}")
 
-def download_csv_from_url(url: str) -> str:
+async def download_csv_from_url(url: str) -> bytes:
+    """
+    Download a remote CSV asynchronously, streaming it with a size guard.
+
+    Args:
+        url (str): Direct URL pointing to a raw CSV file.
+
+    Returns:
+        bytes: Raw downloaded CSV content.
+
+    Raises:
+        HTTPException: If the download fails, times out, or exceeds MAX_CSV_SIZE.
+    """
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return response.text
-    except requests.exceptions.Timeout:
+        async with httpx.AsyncClient(timeout=15, follow_redirects=True) as client:
+            async with client.stream("GET", url) as response:
+                response.raise_for_status()
+                content = bytearray()
+                async for chunk in response.aiter_bytes(COPY_CHUNK_SIZE):
+                    content.extend(chunk)
+                    if len(content) > MAX_CSV_SIZE:
+                        raise HTTPException(status_code=400, detail=f"File too large. Maximum size is {MAX_CSV_SIZE / (1024 * 1024)} MB.")
+                return bytes(content)
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
         raise HTTPException(status_code=400, detail="Request to download CSV timed out.")
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=400, detail=f"Failed to download CSV: {e}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to download CSV: {e}")
 
-def summarize_csv(file_content: str) -> str:
+def _content_key(file_content: str | bytes | Path) -> str:
+    """
+    Compute a fast, non-cryptographic cache key for CSV content.
+
+    Args:
+        file_content (str | bytes | Path): Raw CSV content, or path to a saved
+            CSV file (hashed in chunks without loading it whole).
+
+    Returns:
+        str: Hex digest of the content.
+    """
+    if isinstance(file_content, Path):
+        hasher = xxhash.xxh3_64()
+        with open(file_content, "rb") as f:
+            while chunk := f.read(COPY_CHUNK_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    if isinstance(file_content, str):
+        file_content = file_content.encode("utf-8")
+    return xxhash.xxh3_64(file_content).hexdigest()
+
+
+def _load_dataframe(file_content: str | bytes | Path, key: str) -> pd.DataFrame:
+    """
+    Parse CSV content into a DataFrame, reusing a cached parse when available.
+
+    Args:
+        file_content (str | bytes | Path): Raw CSV content or path to a saved CSV file.
+        key (str): Cache key from _content_key().
+
+    Returns:
+        pd.DataFrame: Parsed dataset (treat as read-only; it is shared).
+    """
+    df = _DF_CACHE.get(key)
+    if df is None:
+        if isinstance(file_content, Path):
+            source = file_content
+        elif isinstance(file_content, bytes):
+            source = BytesIO(file_content)
+        else:
+            source = StringIO(file_content)
+        # Multi-threaded Arrow C++ parser with Arrow-backed (zero-copy) columns.
+        # It rejects short rows and keeps duplicate headers as-is, so such files
+        # are re-parsed with the default engine (NaN-filled rows, "a.1" renames).
+        try:
+            df = pd.read_csv(source, engine='pyarrow', dtype_backend='pyarrow', encoding='utf-8-sig')
+        except pd.errors.ParserError:
+            df = None
+        if df is None or df.columns.has_duplicates:
+            if not isinstance(source, Path):
+                source.seek(0)
+            df = pd.read_csv(source, dtype_backend='pyarrow', encoding='utf-8-sig')
+        _DF_CACHE[key] = df
+    return df
+
+
+def summarize_csv(file_content: str | bytes | Path) -> str:
     """
     Create a simple textual summary of a CSV file using pandas.
 
     Args:
-        file_content (str): Raw CSV content as a string.
+        file_content (str | bytes | Path): Raw CSV content or path to a saved CSV file.
 
     Returns:
         str: Summary including shape, columns, and missing values.
     """
     try:
-        df = pd.read_csv(StringIO(file_content), encoding='utf-8-sig')
+        key = _content_key(file_content)
+        cached = _SUMMARY_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        df = _load_dataframe(file_content, key)
         if df.empty:
             return "❌ CSV file trống hoặc không có dữ liệu hợp lệ."
         
@@ -77,29 +229,37 @@ def summarize_csv(file_content: str) -> str:
         if not numeric_cols.empty:
             summary += "\nStatistics for numeric columns:\n" + str(numeric_cols.describe()) + "\n"
 
-        object_cols = df.select_dtypes(include='object')
-        for col in object_cols.columns:
+        # Arrow-backed text columns are string[pyarrow] rather than object
+        text_cols = [col for col in df.columns if pd.api.types.is_string_dtype(df[col].dtype)]
+        for col in text_cols:
             summary += f"\nTop values for {col}:\n{df[col].value_counts().head(3)}\n"
         
+        _SUMMARY_CACHE[key] = summary
         return summary
     except pd.errors.EmptyDataError:
         return "❌ Failed to summarize CSV: No columns to parse from file"
     except Exception as e:
         return f"❌ Failed to summarize CSV: {str(e)}"
 
-def generate_histogram_data(file_content: str, column: str) -> dict:
+def generate_histogram_data(file_content: str | bytes | Path, column: str) -> dict:
     """
     Generate histogram data for a specified numeric column in the CSV.
 
     Args:
-        file_content (str): Raw CSV content as a string.
+        file_content (str | bytes | Path): Raw CSV content or path to a saved CSV file.
         column (str): Name of the column to generate histogram for.
 
     Returns:
         dict: Histogram data with bins and counts, or error message.
     """
     try:
-        df = pd.read_csv(StringIO(file_content), encoding='utf-8-sig')
+        key = _content_key(file_content)
+        cache_key = (key, column.lower())
+        cached = _HISTOGRAM_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+        df = _load_dataframe(file_content, key)
         if df.empty:
             return {"error": "CSV file is empty or contains no valid data."}
         
@@ -112,18 +272,64 @@ def generate_histogram_data(file_content: str, column: str) -> dict:
         if not pd.api.types.is_numeric_dtype(df[matching_column]):
             return {"error": f"Column '{matching_column}' is not numeric."}
         
-        # Calculate histogram
-        hist, bins = np.histogram(df[matching_column].dropna(), bins=10)
-        return {
+        # Calculate histogram (same edges as np.histogram(bins=10), JIT-compiled counting)
+        arr = df[matching_column].dropna().to_numpy(np.float64)
+        if arr.size == 0:
+            lo, hi = 0.0, 1.0
+        else:
+            lo, hi = float(arr.min()), float(arr.max())
+            if not (np.isfinite(lo) and np.isfinite(hi)):
+                raise ValueError(f"autodetected range of [{lo}, {hi}] is not finite")
+            if lo == hi:
+                lo, hi = lo - 0.5, hi + 0.5
+        bins = np.linspace(lo, hi, 11)
+        hist = _hist10(arr, bins)
+        result = {
             "column": matching_column,
             "bins": bins.tolist(),
             "counts": hist.tolist()
         }
+        _HISTOGRAM_CACHE[cache_key] = result
+        return result
     except pd.errors.EmptyDataError:
         return {"error": "No columns to parse from file."}
     except Exception as e:
         return {"error": f"Failed to generate histogram: {str(e)}"}
 
+# Static instruction block: kept byte-identical across requests so it forms a
+# stable, cacheable prompt prefix. Per-request data goes after it.
+CSV_ANALYSIS_INSTRUCTION = (
+    "**ANALYZE THE CSV FILE DESCRIBED IN THE DATASET CONTEXT BELOW.**\n\n"
+    "**IMPORTANT: In your answer, ALWAYS reference the file name given in the dataset context specifically. "
+    "Mention the file name when explaining results, trends, or insights.**\n\n"
+    "Provide detailed analysis based on the data.\n"
+)
+
+
+def _build_data_prompt(prompt: str, csv_summary: str, file_name: str = None) -> str:
+    """
+    Build the CSV analysis prompt as stable prefix -> dynamic context -> user turn.
+
+    Args:
+        prompt (str): User's question about the dataset.
+        csv_summary (str): Pre-processed summary of the CSV data.
+        file_name (str, optional): Name of the analyzed file.
+
+    Returns:
+        str: Full prompt for Gemini.
+    """
+    file_reference = f"**{file_name}**" if file_name else "Uploaded CSV file"
+    return (
+        f"{CSV_ANALYSIS_INSTRUCTION}\n"
+        f"--- Dataset context ---\n"
+        f"File: {file_reference}\n\n"
+        f"Dataset Summary from {file_name or 'CSV file'}:\n"
+        f"{csv_summary or 'No data summary provided.'}\n\n"
+        f"--- User Question ---\n"
+        f"{prompt}\n"
+    )
+
+
 def ask_gemini_about_data(prompt: str, csv_summary: str, file_name: str = None) -> str:
     """
     Ask Gemini to analyze or summarize a dataset based on user input.
@@ -138,68 +344,46 @@ def ask_gemini_about_data(prompt: str, csv_summary: str, file_name: str = None)
     try:
         model = get_model()
         
-        # ✅ PROMPT MỚI - BẮT BUỘC THAM CHIẾU FILE!
-        file_reference = f"File: **{file_name}**" if file_name else "Uploaded CSV file"
-        full_prompt = f"""
-                        **ANALYZE THE FOLLOWING CSV FILE: {file_reference}**
-
-                        User Question: {prompt}
-
-                        Dataset Summary from {file_name or 'CSV file'}:
-                        {csv_summary or 'No data summary provided.'}
-
-                        **IMPORTANT: In your answer, ALWAYS reference the file "{file_name or 'CSV file'}" specifically. 
-                        Mention the file name when explaining results, trends, or insights.**
-
-                        Provide detailed analysis based on the data.
-                        """
+        full_prompt = _build_data_prompt(prompt, csv_summary, file_name)
         
         response = model.generate_content(full_prompt)
         return response.text.strip() if response and response.text else f"(No response from Gemini about {file_name})"
         
     except Exception as e:
-        print(f"[CSVService] Data query failed: {e}")
+        logger.exception("CSV data query failed")
         return f"❌ Error analyzing **{file_name}**: {e}"
 
 
+async def ask_gemini_about_data_async(prompt: str, csv_summary: str, file_name: str = None) -> str:
+    """
+    Non-blocking version of ask_gemini_about_data (runs in a worker thread).
+
+    Args:
+        prompt (str): User's question about the dataset.
+        csv_summary (str): Pre-processed summary of the CSV data.
+        file_name (str, optional): Name of the analyzed file.
+
+    Returns:
+        str: Gemini's analytical response about the dataset.
+    """
+    return await anyio.to_thread.run_sync(ask_gemini_about_data, prompt, csv_summary, file_name)
+
+
 async def ask_gemini_about_data_streaming(prompt: str, csv_summary: str, file_name: str = None):
     """
     Streaming version - TƯƠNG TỰ!
+
+    The blocking Gemini stream is iterated in a worker thread, so other
+    requests keep being served while chunks arrive.
     """
     try:
         model = get_model()
         
-        file_reference = f"File: **{file_name}**" if file_name else "Uploaded CSV file"
-        full_prompt = f"""
-                        **ANALYZE THE FOLLOWING CSV FILE: {file_reference}**
-
-                        User Question: {prompt}
-
-                        Dataset Summary from {file_name or 'CSV file'}:
-                        {csv_summary or 'No data summary provided.'}
-
-                        **IMPORTANT: In your answer, ALWAYS reference the file "{file_name or 'CSV file'}" specifically. 
-                        Mention the file name when explaining results, trends, or insights.**
-
-                        Provide detailed analysis based on the data.
-                        """
-        
-        response = model.generate_content(full_prompt, stream=True)
-        full_text = ""
+        full_prompt = _build_data_prompt(prompt, csv_summary, file_name)
         
-        for chunk in response:
-            if chunk.text:
-                text = chunk.text
-                full_text += text
-                yield text 
-                
-        if full_text.strip():
-            yield full_text.strip()
+        async for text in stream_text(iterate_in_thread(model.generate_content, full_prompt, stream=True)):
+            yield text
             
     except Exception as e:
-        print(f"[CSVService] Streaming failed: {e}")
-        yield f"❌ Error analyzing **{file_name}**: {e}"
-        
-    except Exception as e:
-        print(f"[CSVService] Streaming failed: {e}")
+        logger.exception("CSV data streaming query failed")
         yield f"❌ Error analyzing **{file_name}**: {e}"
\ No newline at end of file
@@ -5,53 +5,446 @@ Handles text-based conversations with Gemini and provides
 a shared client configuration for other services (image, CSV).
 """
 
+import asyncio
+import logging
+import re
+import threading
+import anyio
+import orjson
+import xxhash
+from cachetools import TTLCache
 import google.generativeai as genai
-from utils.config import GEMINI_API_KEY, GEMINI_MODEL
+from google.api_core import exceptions as google_exceptions
+from google.api_core import retry as google_retry
+from google.api_core import retry_async as google_retry_async
+from utils.config import (
+    GEMINI_API_KEY,
+    GEMINI_MODEL,
+    SEMANTIC_CACHE_THRESHOLD,
+    GEMINI_BATCH_WINDOW_MS,
+    GEMINI_BATCH_SIZE,
+    GEMINI_MAX_INFLIGHT,
+)
+from services.semantic_cache import SemanticCache
+from services.batch_queue import BatchQueue
+
+logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------
 # ✅ Configure Gemini Client (runs once globally)
 # ------------------------------------------------------------
+# The default transport keeps one long-lived gRPC HTTP/2 channel (keep-alive,
+# multiplexed streams) per process for the sync client and one grpc.aio channel
+# for the async client, so every request reuses the same TCP+TLS session.
+# Don't pin transport="grpc": that would also force it onto the async client.
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Shared model handle; GenerativeModel holds no per-request state
+_model = genai.GenerativeModel(GEMINI_MODEL)
+
+# ------------------------------------------------------------
+# 🧭 Text-chat system prompt
+# ------------------------------------------------------------
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant in a chat application. "
+    "Answer clearly and accurately, and use Markdown formatting when it improves readability."
+)
+# Identifies the prompt version in response-cache keys, so an edited prompt never reuses stale replies
+SYSTEM_PROMPT_DIGEST = xxhash.xxh3_64_hexdigest(SYSTEM_PROMPT.encode("utf-8"))
+
+# Shared text-chat model sending SYSTEM_PROMPT as its system instruction. The
+# prompt is far below Gemini's minimum size for explicit context caching
+# (CachedContent); revisit that once it grows long enough to qualify.
+_chat_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SYSTEM_PROMPT)
+
+# ------------------------------------------------------------
+# 🚦 Concurrency gate and retry policy for text requests
+# ------------------------------------------------------------
+# Rate limits (429) and transient server errors are retried with jittered
+# exponential backoff (0.2 s doubling up to 4 s, 20 s in total); the SDK's
+# default policy only retries 503, starting at 1 s
+_RETRY_POLICY = dict(
+    predicate=google_retry.if_exception_type(
+        google_exceptions.TooManyRequests,  # includes ResourceExhausted
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+    ),
+    initial=0.2,
+    maximum=4.0,
+    multiplier=2.0,
+    timeout=20.0,
+)
+REQUEST_OPTIONS = {"retry": google_retry.Retry(**_RETRY_POLICY)}
+ASYNC_REQUEST_OPTIONS = {"retry": google_retry_async.AsyncRetry(**_RETRY_POLICY)}
+
+# Caps in-flight Gemini text requests per process so bursts queue here
+# instead of piling onto the shared channel and the rate limit
+_inflight = asyncio.Semaphore(GEMINI_MAX_INFLIGHT)
+
+# ------------------------------------------------------------
+# ⚡ Exact-match response cache (identical conversations skip Gemini)
+# ------------------------------------------------------------
+RESPONSE_CACHE_SIZE = 10_000
+RESPONSE_CACHE_TTL = 1800  # seconds
+_response_cache: TTLCache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+_response_cache_lock = threading.Lock()
+# Replies depend on the model and the system prompt, so both are part of every key
+_MODEL_KEY_PREFIX = f"{GEMINI_MODEL}\n{SYSTEM_PROMPT_DIGEST}\n".encode("utf-8")
+
+# Paraphrase-tolerant cache, only consulted for single-turn prompts so a
+# follow-up like "and what about it?" never matches another conversation
+_semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL)
+
+
+def _response_cache_key(messages: list[dict]) -> bytes:
+    """
+    Build a cache key from the canonicalized conversation and model name.
+
+    Args:
+        messages (list[dict]): List of messages for multi-turn conversation.
+
+    Returns:
+        bytes: Digest identifying this exact request (only used as a dict key).
+    """
+    # xxh3_128: keys are process-local and not security sensitive, so take the fastest hash
+    hasher = xxhash.xxh3_128(_MODEL_KEY_PREFIX)
+    hasher.update(orjson.dumps(messages, option=orjson.OPT_SORT_KEYS))
+    return hasher.digest()
+
 
 def get_model():
     """
-    Get a configured Gemini model instance.
+    Get the shared Gemini model instance.
 
     Returns:
         genai.GenerativeModel: Pre-configured Gemini model ready for inference.
     """
-    return genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+def get_chat_model():
+    """
+    Get the shared text-chat model, with SYSTEM_PROMPT as its system instruction.
+
+    Returns:
+        genai.GenerativeModel: Model for text chat requests.
+    """
+    return _chat_model
+
+
+async def iterate_in_thread(func, *args, **kwargs):
+    """
+    Consume a blocking iterator (e.g. a streaming Gemini response) without
+    blocking the event loop.
+
+    ``func(*args, **kwargs)`` is called and iterated in a worker thread; each
+    item is handed back to the loop through an asyncio.Queue and yielded here.
+    Exceptions raised by the producer are re-raised in the caller.
+
+    Args:
+        func (Callable): Blocking callable returning an iterable.
+        *args: Positional arguments for ``func``.
+        **kwargs: Keyword arguments for ``func``.
+
+    Yields:
+        Each item produced by the iterable.
+    """
+    loop = asyncio.get_running_loop()
+    # Items are (done, value): (False, item) per element, then (True, error or None)
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def producer():
+        error = None
+        try:
+            for item in func(*args, **kwargs):
+                if stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, (False, item))
+        except Exception as e:
+            error = e
+        if not stop.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, (True, error))
+
+    worker = loop.run_in_executor(None, producer)
+    try:
+        while True:
+            done, item = await queue.get()
+            if done:
+                if item is not None:
+                    raise item
+                break
+            yield item
+    finally:
+        # Stop the producer early if the client disconnected mid-stream
+        stop.set()
+    await worker
+
+
+async def stream_text(chunks):
+    """
+    Yield the text of streamed Gemini chunks, skipping empty and
+    whitespace-only ones.
+
+    Whitespace-only text is not dropped: it is carried over and prepended
+    to the next non-blank chunk, so spaces and line breaks between tokens
+    survive while callers never wake up for a frame with nothing visible.
+    Trailing whitespace at the end of the stream is discarded.
+
+    Args:
+        chunks: Async iterable of Gemini response chunks.
+
+    Yields:
+        str: Chunk text, as produced by Gemini.
+    """
+    pending = ""
+    async for chunk in chunks:
+        text = chunk.text
+        if not text:
+            continue
+        if text.isspace():
+            pending += text
+            continue
+        if pending:
+            text = pending + text
+            pending = ""
+        yield text
+
+
+def _to_gemini(msg: dict) -> dict:
+    """
+    Convert a {"role", "content"} message to Gemini's content format.
+
+    Parts are a one-element tuple rather than a list to skip an extra
+    list allocation per message.
+
+    Args:
+        msg (dict): Message with "role" and "content" keys.
+
+    Returns:
+        dict: {"role": ..., "parts": ({"text": ...},)}
+    """
+    return {"role": msg["role"], "parts": ({"text": msg["content"]},)}
+
+
+def _to_gemini_contents(messages: list[dict]) -> tuple | list:
+    """
+    Convert a conversation to Gemini contents.
+
+    A lone user turn (the common case: no prior history) is built directly
+    as a one-element tuple; longer conversations go through _to_gemini.
+
+    Args:
+        messages (list[dict]): List of messages for multi-turn conversation.
+
+    Returns:
+        tuple | list: Gemini contents in conversation order.
+    """
+    if len(messages) == 1 and messages[0]["role"] == "user":
+        return ({"role": "user", "parts": ({"text": messages[0]["content"]},)},)
+    return list(map(_to_gemini, messages))
 
 
 # ============================================================
 # 💬 TEXT CHAT — multi-turn or single-turn conversation
 # ============================================================
+def _cached_reply(messages: list[dict]) -> tuple[bytes, object, str | None]:
+    """
+    Look up a conversation in the exact-match and semantic caches.
+
+    Returns:
+        tuple: (cache key, prompt embedding or None, cached reply or None).
+    """
+    key = _response_cache_key(messages)
+    with _response_cache_lock:
+        cached = _response_cache.get(key)
+    if cached is not None:
+        return key, None, cached
+
+    vector = None
+    if SEMANTIC_CACHE_THRESHOLD > 0 and len(messages) == 1:
+        try:
+            vector = _semantic_cache.embed(messages[0]["content"])
+            cached = _semantic_cache.lookup(vector)
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed: %s", e)
+    return key, vector, cached
+
+
+def _store_reply(key: bytes, vector, response) -> str:
+    """Extract the reply text and cache it; empty replies are not cached."""
+    if not (response and response.text):
+        return "(No response from Gemini)"
+    text = response.text.strip()
+    with _response_cache_lock:
+        _response_cache[key] = text
+    if vector is not None:
+        _semantic_cache.add(vector, text)
+    return text
+
+
 def ask_gemini_text(messages: list[dict]) -> str:
     """
     Send a text prompt to Gemini and return the model's response.
 
+    Identical conversations within RESPONSE_CACHE_TTL are answered from an
+    in-process cache, and single-turn prompts that paraphrase a cached one
+    are answered from the semantic cache; errors and empty replies are
+    never cached. Blocking; async code should use ask_gemini_text_async.
+
     Args:
-        prompt (str): User's message or query.
+        messages (list[dict]): List of messages for multi-turn conversation.
 
     Returns:
         str: Gemini's generated text response.
     """
     try:
-        model = get_model()
-        gemini_messages = [
-            {"role": msg["role"], "parts": [{"text": msg["content"]}]}
-            for msg in messages
-        ]
-        response = model.generate_content(gemini_messages)
+        key, vector, cached = _cached_reply(messages)
+        if cached is not None:
+            return cached
 
-        return response.text.strip() if response and response.text else "(No response from Gemini)"
+        model = get_chat_model()
+        gemini_messages = _to_gemini_contents(messages)
+        response = model.generate_content(gemini_messages, request_options=REQUEST_OPTIONS)
+        return _store_reply(key, vector, response)
 
     except Exception as e:
-        print(f"[GeminiService] Text query failed: {e}")
+        logger.exception("Gemini text query failed")
         return f"❌ Error while generating text: {e}"
 
 
+async def _ask_gemini_text_unbatched(messages: list[dict]) -> str:
+    """
+    Async counterpart of ask_gemini_text on the SDK's grpc.aio client.
+
+    The generation round-trip is awaited on the event loop instead of
+    occupying a worker thread; only the embedding lookup of the semantic
+    cache (a blocking call) is pushed to a thread.
+    """
+    try:
+        if SEMANTIC_CACHE_THRESHOLD > 0 and len(messages) == 1:
+            key, vector, cached = await anyio.to_thread.run_sync(_cached_reply, messages)
+        else:
+            key, vector, cached = _cached_reply(messages)
+        if cached is not None:
+            return cached
+
+        model = get_chat_model()
+        gemini_messages = _to_gemini_contents(messages)
+        async with _inflight:
+            response = await model.generate_content_async(gemini_messages, request_options=ASYNC_REQUEST_OPTIONS)
+        return _store_reply(key, vector, response)
+
+    except Exception as e:
+        logger.exception("Gemini text query failed")
+        return f"❌ Error while generating text: {e}"
+
+
+# ------------------------------------------------------------
+# 📦 Micro-batching of concurrent single-turn prompts
+# ------------------------------------------------------------
+BATCH_INSTRUCTION = (
+    "The queries below are given as a JSON array of strings; query n is the "
+    "n-th element (counting from 1), and each element is one complete query "
+    "even if its text contains its own numbering. Answer each query "
+    "independently; the queries are unrelated. Start every answer on its own "
+    "line with the marker [[ANSWER n]], where n is the query number, and write "
+    "nothing before the first marker.\n\n"
+)
+_BATCH_MARKER_RE = re.compile(r"^\s*\[\[ANSWER (\d+)\]\]\s*", re.MULTILINE)
+# Prompts mentioning the marker anywhere could steer how the reply is split
+_BATCH_MARKER_MENTION_RE = re.compile(r"\[\[\s*ANSWER", re.IGNORECASE)
+
+
+def _batchable(messages: list[dict]) -> bool:
+    """True for a stateless single-turn prompt that is safe to row-marshal."""
+    return (
+        GEMINI_BATCH_WINDOW_MS > 0
+        and len(messages) == 1
+        and messages[0]["role"] == "user"
+        and not _BATCH_MARKER_MENTION_RE.search(messages[0]["content"])
+    )
+
+
+def _split_batch_reply(text: str, count: int) -> list[str] | None:
+    """
+    Split a row-marshaled reply into one answer per query.
+
+    Returns None unless exactly the markers 1..count appear, in order,
+    so a malformed reply never hands one caller another caller's answer.
+    """
+    parts = _BATCH_MARKER_RE.split(text)
+    numbers = parts[1::2]
+    if numbers != [str(i) for i in range(1, count + 1)]:
+        return None
+    answers = [answer.strip() for answer in parts[2::2]]
+    return answers if all(answers) else None
+
+
+async def _ask_gemini_batched(prompts: list[str]) -> list[str] | None:
+    """
+    Answer several independent prompts with a single Gemini call.
+
+    Answers are returned to their requesters only and never cached: one
+    prompt in the batch can still influence another's answer, so it must
+    not be served to anyone else. Returns None if the call fails or the
+    reply cannot be split reliably, in which case the caller falls back
+    to one call per prompt.
+    """
+    # JSON-encode the queries so user text (newlines, numbered lists, quotes)
+    # can never be mistaken for a separate query row
+    batch_prompt = BATCH_INSTRUCTION + orjson.dumps(prompts).decode("utf-8")
+    try:
+        model = get_chat_model()
+        async with _inflight:
+            response = await model.generate_content_async(batch_prompt, request_options=ASYNC_REQUEST_OPTIONS)
+        answers = _split_batch_reply(response.text, len(prompts)) if response and response.text else None
+    except Exception:
+        logger.exception("Gemini batched query failed")
+        return None
+    return answers
+
+
+async def _answer_batch(prompts: list[str]) -> list[str]:
+    """BatchQueue handler: one row-marshaled call, or individual calls as fallback."""
+    if len(prompts) > 1:
+        answers = await _ask_gemini_batched(prompts)
+        if answers is not None:
+            return answers
+    return list(await asyncio.gather(*(
+        _ask_gemini_text_unbatched([{"role": "user", "content": p}]) for p in prompts
+    )))
+
+
+_batch_queue = BatchQueue(_answer_batch, max_batch=GEMINI_BATCH_SIZE, window=GEMINI_BATCH_WINDOW_MS / 1000)
+
+
+async def ask_gemini_text_async(messages: list[dict]) -> str:
+    """
+    Non-blocking version of ask_gemini_text for use inside async routes.
+
+    Awaits the SDK's async client, so many concurrent Gemini calls share
+    the event loop instead of each holding a worker thread. When
+    GEMINI_BATCH_WINDOW_MS is set, stateless single-turn prompts that miss
+    the exact-match cache are coalesced with concurrent ones into a single
+    Gemini call; multi-turn conversations and prompts mentioning the
+    [[ANSWER n]] marker are never batched.
+
+    Args:
+        messages (list[dict]): List of messages for multi-turn conversation.
+
+    Returns:
+        str: Gemini's generated text response.
+    """
+    if _batchable(messages):
+        with _response_cache_lock:
+            cached = _response_cache.get(_response_cache_key(messages))
+        if cached is not None:
+            return cached
+        return await _batch_queue.submit(messages[0]["content"])
+    return await _ask_gemini_text_unbatched(messages)
+
+
 async def ask_gemini_text_streaming(messages: list[dict]) -> str:
     """
     Send a text prompt to Gemini and stream the model's response as chunks.
@@ -63,15 +456,13 @@ async def ask_gemini_text_streaming(messages: list[dict]) -> str:
         str: Each chunk of the generated text from Gemini.
     """
     try:
-        model = get_model()
-        gemini_messages = [
-            {"role": msg["role"], "parts": [{"text": msg["content"]}]}
-            for msg in messages
-        ]
-        response = model.generate_content(gemini_messages, stream=True)
-        for chunk in response:
-            if chunk.text:
-                yield chunk.text.strip()  # Yield each chunk
+        model = get_chat_model()
+        gemini_messages = _to_gemini_contents(messages)
+        async with _inflight:
+            async for text in stream_text(iterate_in_thread(
+                model.generate_content, gemini_messages, stream=True, request_options=REQUEST_OPTIONS
+            )):
+                yield text  # Yield each chunk
     except Exception as e:
-        print(f"[GeminiService] Text streaming query failed: {e}")
+        logger.exception("Gemini text streaming query failed")
         yield f"❌ Error while generating text: {e}"  # Yield error as chunk
\ No newline at end of file
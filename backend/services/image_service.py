@@ -4,13 +4,17 @@ image_service.py
 Handles image saving, validation, and preprocessing for image chat.
 """
 
+import logging
 import os
 from pathlib import Path
 from fastapi import UploadFile, HTTPException
 from datetime import datetime
 from PIL import Image, UnidentifiedImageError
 import shutil
-from services.gemini_service import get_model
+import anyio
+from services.gemini_service import get_model, iterate_in_thread, stream_text
+
+logger = logging.getLogger(__name__)
 
 
 # Directory to store temporary uploaded images
@@ -95,7 +99,7 @@ def save_uploaded_image(file: UploadFile) -> str:
         raise
     except Exception as e:
         # Log specific error for debugging
-        print(f"[ImageService] Failed to save uploaded image: {e}")
+        logger.exception("Failed to save uploaded image")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to save uploaded image: {str(e)}"
@@ -128,9 +132,23 @@ def ask_gemini_with_image(prompt: str, image_path: str) -> str:
         return response.text.strip() if response and response.text else "(No response from Gemini)"
 
     except Exception as e:
-        print(f"[GeminiService] Image query failed: {e}")
+        logger.exception("Image query failed")
         return f"❌ Error while analyzing image: {e}"
 
+
+async def ask_gemini_with_image_async(prompt: str, image_path: str) -> str:
+    """
+    Non-blocking version of ask_gemini_with_image (runs in a worker thread).
+
+    Args:
+        prompt (str): The user's question or instruction about the image.
+        image_path (str): Path to the uploaded image file (JPG/PNG).
+
+    Returns:
+        str: The response generated by Gemini based on the image and prompt.
+    """
+    return await anyio.to_thread.run_sync(ask_gemini_with_image, prompt, image_path)
+
     
 async def ask_gemini_with_image_streaming(prompt: str, image_path: str):
     """
@@ -153,10 +171,8 @@ async def ask_gemini_with_image_streaming(prompt: str, image_path: str):
 
         model = get_model()
         full_prompt = f"Analyze the provided image and answer the following question clearly referencing the image: {prompt}"
-        response = model.generate_content([full_prompt, img], stream=True)
-        for chunk in response:
-            if chunk.text:
-                yield chunk.text.strip()  # Yield each chunk
+        async for text in stream_text(iterate_in_thread(model.generate_content, [full_prompt, img], stream=True)):
+            yield text  # Yield each chunk
     except Exception as e:
-        print(f"[ImageService] Image streaming query failed: {e}")
+        logger.exception("Image streaming query failed")
         yield f"❌ Error while analyzing image: {e}"
\ No newline at end of file
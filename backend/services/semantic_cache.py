@@ -0,0 +1,94 @@
+"""
+semantic_cache.py
+------------------
+In-process semantic cache: returns a stored Gemini reply when a new prompt
+is a close paraphrase (cosine similarity of embeddings) of a cached one.
+"""
+
+import threading
+import time
+import numpy as np
+import google.generativeai as genai
+
+# Gemini embedding endpoint used for prompt vectors
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+class SemanticCache:
+    """
+    Flat inner-product index over unit-normalized prompt embeddings.
+
+    Entries live in a preallocated ring buffer, so the oldest entry is
+    overwritten once ``max_entries`` is reached, and an entry older than
+    ``ttl`` seconds is never returned.
+    """
+
+    def __init__(self, threshold: float = 0.85, max_entries: int = 10_000, ttl: float = 1800):
+        """
+        Args:
+            threshold (float): Minimum cosine similarity counted as a hit.
+            max_entries (int): Maximum number of cached prompts.
+            ttl (float): Seconds an entry stays valid.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._vectors = None  # (max_entries, dim) float32, allocated on first add
+        self._expires = np.zeros(max_entries, dtype=np.float64)  # time.monotonic() deadlines
+        self._responses: list = [None] * max_entries
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def embed(text: str) -> np.ndarray:
+        """
+        Embed a prompt with Gemini and normalize it to unit length.
+
+        Args:
+            text (str): Prompt text.
+
+        Returns:
+            np.ndarray: float32 unit vector.
+        """
+        result = genai.embed_content(model=EMBEDDING_MODEL, content=text, task_type="SEMANTIC_SIMILARITY")
+        vector = np.asarray(result["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector: np.ndarray) -> str | None:
+        """
+        Find the cached reply whose prompt is most similar to ``vector``.
+
+        Args:
+            vector (np.ndarray): Unit vector from embed().
+
+        Returns:
+            str | None: Cached reply if similarity >= threshold, else None.
+        """
+        with self._lock:
+            if self._size == 0:
+                return None
+            scores = self._vectors[:self._size] @ vector
+            scores[self._expires[:self._size] <= time.monotonic()] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                return self._responses[best]
+        return None
+
+    def add(self, vector: np.ndarray, response: str) -> None:
+        """
+        Store a reply under its prompt embedding.
+
+        Args:
+            vector (np.ndarray): Unit vector from embed().
+            response (str): Gemini reply to cache.
+        """
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self._vectors[self._next] = vector
+            self._responses[self._next] = response
+            self._expires[self._next] = time.monotonic() + self.ttl
+            self._next = (self._next + 1) % self.max_entries
+            self._size = min(self._size + 1, self.max_entries)
@@ -5,16 +5,41 @@ Utility for loading environment variables and configuring global settings.
 """
 
 import os
+from typing import Final
 from dotenv import load_dotenv
 
-# Load .env file
-load_dotenv()
+# Load .env file (containers that inject the environment directly can set LOAD_DOTENV=0)
+if os.getenv("LOAD_DOTENV", "1") == "1":
+    load_dotenv()
+
+
+def _require(name: str) -> str:
+    """Read a mandatory environment variable, failing at import if it is missing or empty."""
+    try:
+        value = os.environ[name]
+    except KeyError:
+        raise ValueError(f"❌ {name} not found in environment variables.") from None
+    if not value.strip():
+        raise ValueError(f"❌ {name} is set but empty.")
+    return value
+
 
 # Retrieve Gemini API key from environment
-GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
-GEMINI_MODEL: str = os.getenv("GEMINI_MODEL", "")
+GEMINI_API_KEY: Final[str] = _require("GEMINI_API_KEY")
+GEMINI_MODEL: Final[str] = _require("GEMINI_MODEL")
+
+# Semantic cache for single-turn prompts (similarity threshold in [0, 1], 0 disables).
+# Off by default: it is shared by all users, so a merely similar prompt gets
+# another user's reply, and every miss costs an embedding round-trip.
+SEMANTIC_CACHE_THRESHOLD: Final[float] = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))
+
+# Micro-batching of concurrent single-turn prompts into one Gemini call
+# (collection window in milliseconds, 0 disables; batch size 4-8).
+# Off by default: a batched call shows every user's prompt to the model while
+# it writes each answer, so one user's prompt can be seen by, and steer,
+# another user's answer. Keep it at 0 in any multi-user deployment.
+GEMINI_BATCH_WINDOW_MS: Final[float] = float(os.getenv("GEMINI_BATCH_WINDOW_MS", "0"))
+GEMINI_BATCH_SIZE: Final[int] = int(os.getenv("GEMINI_BATCH_SIZE", "4"))
 
-if not GEMINI_API_KEY:
-    raise ValueError("❌ GEMINI_API_KEY not found in environment variables.")
-if not GEMINI_MODEL:
-    raise ValueError("❌ GEMINI_MODEL not found in environment variables.")
+# Maximum concurrent Gemini text requests per worker process
+GEMINI_MAX_INFLIGHT: Final[int] = int(os.getenv("GEMINI_MAX_INFLIGHT", "32"))
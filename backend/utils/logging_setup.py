@@ -0,0 +1,37 @@
+"""
+logging_setup.py
+-----------------
+Routes application log records through a queue so formatting and stderr
+writes happen on a background thread instead of the request-serving one.
+"""
+
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+def start_log_listener() -> QueueListener:
+    """
+    Attach a QueueHandler to the root logger and start its listener thread.
+
+    The level is taken from the LOG_LEVEL environment variable (default INFO).
+
+    Returns:
+        QueueListener: Running listener; call ``stop()`` on shutdown to flush it.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # Replace the handler from a previous startup in this process (e.g. reloads, tests)
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
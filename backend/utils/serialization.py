@@ -0,0 +1,144 @@
+"""
+serialization.py
+-----------------
+Fast JSON helpers built on orjson, shared by the routers for SSE frames
+and JSON responses.
+"""
+
+import asyncio
+from typing import AsyncIterator
+from pydantic import BaseModel
+import orjson
+
+
+def orjson_default(obj):
+    """
+    Fallback encoder for Pydantic models, which orjson does not serialize
+    natively (datetimes are handled by orjson itself).
+
+    Args:
+        obj: Object that orjson could not serialize.
+
+    Returns:
+        dict: The model's fields.
+
+    Raises:
+        TypeError: If the object is not a Pydantic model.
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type {type(obj).__name__} is not JSON serializable")
+
+
+def to_json(obj, option: int = 0) -> str:
+    """
+    Serialize an object to a JSON string using orjson.
+
+    Args:
+        obj: Object to serialize (dicts, lists, datetimes, Pydantic models...).
+        option (int): Optional orjson flags, e.g. orjson.OPT_INDENT_2.
+
+    Returns:
+        str: UTF-8 JSON string (non-ASCII characters are kept as-is).
+    """
+    return orjson.dumps(obj, default=orjson_default, option=option).decode()
+
+
+# Pre-encoded SSE framing for the per-token hot path
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_CHUNK_PREFIX = b'data: {"chunk":'
+_SSE_CHUNK_SUFFIX = b"}\n\n"
+
+
+def sse_event(obj) -> bytes:
+    """
+    Encode an object as a single Server-Sent Events frame.
+
+    Args:
+        obj: JSON-serializable payload (e.g. {"reply": ...} or {"history": ...}).
+
+    Returns:
+        bytes: Frame of the form b'data: {...}\\n\\n'.
+    """
+    return _SSE_PREFIX + orjson.dumps(obj, default=orjson_default) + _SSE_SUFFIX
+
+
+def sse_chunk(chunk: str) -> bytes:
+    """
+    Encode a streamed text chunk as an SSE frame without building a dict.
+
+    Equivalent to sse_event({"chunk": chunk}), but only the string itself
+    goes through orjson.
+
+    Args:
+        chunk (str): Text chunk from Gemini.
+
+    Returns:
+        bytes: Frame of the form b'data: {"chunk":"..."}\\n\\n'.
+    """
+    return _SSE_CHUNK_PREFIX + orjson.dumps(chunk) + _SSE_CHUNK_SUFFIX
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[str],
+    max_chunks: int = 8,
+    max_delay: float = 0.05,
+) -> AsyncIterator[str]:
+    """
+    Merge small streamed text chunks so fewer SSE frames hit the socket.
+
+    A merged chunk is emitted once ``max_chunks`` pieces are buffered or
+    ``max_delay`` seconds after the previous emit, whichever comes first
+    (the first chunk of a stream is never held).
+    The deadline is enforced with a timer, so buffered text is flushed on
+    time even while the source is still waiting for its next chunk;
+    anything left is flushed when the source ends.
+
+    Args:
+        chunks (AsyncIterator[str]): Source of text chunks (e.g. Gemini stream).
+        max_chunks (int): Maximum number of pieces merged into one chunk.
+        max_delay (float): Maximum time in seconds to hold buffered pieces.
+
+    Yields:
+        str: Concatenated text of the buffered pieces.
+    """
+    loop = asyncio.get_running_loop()
+    source = chunks.__aiter__()
+    buffer: list[str] = []
+    last_emit = loop.time() - max_delay  # the first chunk goes out immediately
+    pending: asyncio.Future | None = None  # in-flight source.__anext__()
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            # Only wait on a deadline while there is something to flush
+            timeout = max(0.0, last_emit + max_delay - loop.time()) if buffer else None
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer.clear()
+                last_emit = loop.time()
+                continue
+
+            finished, pending = pending, None
+            try:
+                chunk = finished.result()
+            except StopAsyncIteration:
+                break
+            buffer.append(chunk)
+            if len(buffer) >= max_chunks or loop.time() - last_emit >= max_delay:
+                yield "".join(buffer)
+                buffer.clear()
+                last_emit = loop.time()
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        # Consumer went away (e.g. client disconnect): stop the source read
+        if pending is not None:
+            pending.cancel()
+            # Wait without awaiting the task itself, so a cancellation aimed at
+            # this consumer still propagates; then mark the read's outcome as seen
+            await asyncio.wait((pending,))
+            if not pending.cancelled():
+                pending.exception()